@@ -2,13 +2,13 @@
 """Script to help transition from mono-repo to split declarative repos"""
 import argparse
 import logging
+import os
 from pathlib import Path
 
-from more_itertools import flatten, one
+from more_itertools import one
 
 from .smart_sync.helpers import find_packages_in_config
 from .utils.args import add_standard_flags
-from .utils.aurutils import PkgInfo
 from .utils.errors import UserErrorMessage
 from .utils.misc import (
     packages_in_repos_full,
@@ -61,25 +61,55 @@ def create_pacman_conf(sync_config: SyncConfig, base_path: Path):
         print("")
 
 
+def _scan_source_path(
+    source_path: Path,
+) -> tuple[dict[str, dict[str, Path]], list[Path]]:
+    """Index the packages and databases in the source path with a single directory scan
+
+    :param source_path: Directory with the old mono-repo
+    :return: Mapping from package name to mapping from version to file, and list of database files
+    """
+    packages: dict[str, dict[str, Path]] = {}
+    databases: list[Path] = []
+    with os.scandir(source_path) as it:
+        for entry in it:
+            if entry.name.endswith(".db.tar.gz"):
+                databases.append(Path(entry.path))
+            elif entry.name.endswith(".pkg.tar.zst"):
+                # File names are {pkgname}-{pkgver}-{pkgrel}-{arch}.pkg.tar.zst, and only
+                # pkgname may contain dashes.
+                parts = entry.name.rsplit("-", maxsplit=3)
+                if len(parts) != 4:
+                    continue
+                name, ver, rel, _ = parts
+                packages.setdefault(name, {})[f"{ver}-{rel}"] = Path(entry.path)
+    return packages, databases
+
+
 def move_commands(
     sync_config: SyncConfig,
     repos: dict[str, FileRepo],
     base_path: Path,
     source_path: Path,
 ):
+    # Nothing to do if all repositories already live in the source path
+    if all(base_path / repo == source_path for repo in sync_config["repositories"]):
+        return
+
     # Find what is in the repositories we have.
     in_repos = packages_in_repos_full(repos)
 
     # Try to resolve to pkgbase (aur depends can't use it so we need to use pkgnames in config, not pkgbase)
     pkgs_in_config = find_packages_in_config(sync_config)
-    pkgbases_in_config, pkg_to_base = resolve_pkgbase(in_repos, pkgs_in_config)
+    # This also gives us the inverse mapping
+    _, pkg_to_base, pkg_info_by_name, base_to_pkgs = resolve_pkgbase(
+        in_repos, pkgs_in_config
+    )
 
-    # Create inverse mapping
-    base_to_pkgs: dict[str, set[str]] = {}
-    pkg_info_by_name: dict[str, PkgInfo] = {}
-    for pkginfo in in_repos:
-        pkg_info_by_name[pkginfo.package] = pkginfo
-        base_to_pkgs.setdefault(pkginfo.pkgbase, set()).add(pkginfo.package)
+    # Index the source path once rather than globbing it for every package
+    files_on_disk, source_dbs = _scan_source_path(source_path)
+    # Only needed once something is actually moved, resolved on first use
+    source_repo: Path | None = None
 
     # Figure out packages to move and generate commands
     for repo, entries in sync_config["repositories"].items():
@@ -88,29 +118,39 @@ def move_commands(
         if source_path == target_path:
             continue
         # Find all siblings via a jump back and forth to pkgbase
-        bases = set(pkg_to_base[e] for e in entries)
+        bases = {pkg_to_base[e] for e in entries}
         if missing := bases.difference(base_to_pkgs):
             _LOGGER.warning("Can't find the following packages: %r", missing)
-        all_entries = set(flatten(base_to_pkgs[e] for e in bases if e in base_to_pkgs))
+        all_entries = set().union(
+            *(base_to_pkgs[e] for e in bases if e in base_to_pkgs)
+        )
         # Figure out packages to move
         pkgs_moved = []
         files_moved = []
         for entry in all_entries:
-            # Avoid dealing with architecture, just use a glob
-            file_name = f"{entry}-{pkg_info_by_name[entry].pkgver}-*.pkg.tar.zst"
-            if list(source_path.glob(file_name)):
+            pkgver = pkg_info_by_name[entry].pkgver
+            if file := files_on_disk.get(entry, {}).get(pkgver):
                 pkgs_moved.append(entry)
-                files_moved.append(source_path / file_name)
+                files_moved.append(file)
         # If any packages were to be moved, print the commands to do so
         if files_moved:
-            print(f"mkdir {target_path}")
-            for file in files_moved:
-                print(f"mv {file} {target_path}")
-            print(
+            if source_repo is None:
+                source_repo = one(
+                    source_dbs,
+                    too_short=UserErrorMessage(
+                        f"No repository database found in {source_path}"
+                    ),
+                    too_long=UserErrorMessage(
+                        f"Multiple repository databases found in {source_path}"
+                    ),
+                )
+            commands = [f"mkdir {target_path}"]
+            commands.extend(f"mv {file} {target_path}" for file in files_moved)
+            commands.append(
                 f"repo-add {(target_path / repo).with_suffix('.db.tar.gz')} {' '.join(str(e) for e in files_moved)}"
             )
-            source_repo = one(source_path.glob("*.db.tar.gz"))
-            print(f"repo-remove {source_repo} {' '.join(pkgs_moved)}")
+            commands.append(f"repo-remove {source_repo} {' '.join(pkgs_moved)}")
+            print(*commands, sep="\n")
 
 
 def process(args: argparse.Namespace):
@@ -2,21 +2,23 @@
 import argparse
 import logging
 import os
+import re
 import shutil
 import subprocess
 import sys
 import tempfile
-from collections.abc import Collection, Mapping
+from collections.abc import Collection, Iterable, Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import networkx as nx
-import regex
-from more_itertools import flatten, one, unique_everseen
+from more_itertools import one
 from prompt_toolkit import print_formatted_text, HTML
 
 from . import ninja_gen
-from .helpers import find_packages_to_have
-from ..utils import aurutils
+from .helpers import ancestors_closure, find_packages_to_have
+from ..utils import aurutils, runtime_dir
 from ..utils.args import add_standard_flags
 from ..utils.errors import (
     UserErrorMessage,
@@ -31,8 +33,14 @@ from ..utils.settings import (
     SyncConfig,
 )
 
+if TYPE_CHECKING:
+    import networkx as nx
+
 _LOGGER = logging.getLogger(name=__name__)
 
+# Pattern to find the stamp file (and thus the package) in ninja dry-run output
+_RE_STAMP = re.compile(r"(\[\d+/\d+\] )(.+?)([\w@.+-]+)(\.stamp)")
+
 
 def _create_parser():
     """Create the parser object"""
@@ -101,7 +109,7 @@ def main():
     # Parse arguments
     parser = _create_parser()
     args = parser.parse_args()
-    args.force_rebuild = set(flatten(args.force_rebuild))
+    args.force_rebuild = set(chain.from_iterable(args.force_rebuild))
 
     with logging_and_error_handling(log_level=args.log_level, debug=args.debug):
         # Start actual program logic
@@ -116,30 +124,42 @@ def process(args: argparse.Namespace):
     repos = custom_repos(pacconf)
     _LOGGER.debug("Repos: %r", repos.keys())
     # Sets of targets to process and things to skip
-    ignored = set()
-    ignored.update(args.ignore)
+    ignored = frozenset(args.ignore)
+    ignored_repos = frozenset(args.ignore_repo)
     # Build up list of packages to have. We should have everything we have the repository for.
-    pkgs_to_have = find_packages_to_have(repos, sync_config)
+    pkgs_to_have = find_packages_to_have(
+        repos, sync_config, ignored_repos=ignored_repos
+    )
     _LOGGER.debug(f"End of step 1: pkgs_to_have=%r", pkgs_to_have)
     # 2. Find what is in the repositories we have.
     # Mapping from package name to version string
-    in_repos = packages_in_repos(repos, ignored_repos=args.ignore_repo)
+    in_repos = packages_in_repos(repos, ignored_repos=ignored_repos)
     # 3. Find packages to process (packages in config missing (but repo exists) + update + devel)
     targets: set[str] = set()
     # Add missing packages
     targets.update(pkgs_to_have.difference(in_repos.keys()))
+    # The update checks below are independent of each other, run them in parallel
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        if args.update:
+            outdated = executor.submit(
+                aurutils.vercmp,
+                {k: in_repos[k] for k in in_repos.keys() - ignored},
+            )
+        if args.vcs:
+            outdated_vcs = executor.submit(
+                set,
+                aurutils.vercmp_devel(
+                    {k: v for k, v in repos.items() if k not in ignored_repos}
+                ),
+            )
     # Add out-of-date packages (this may include things that shouldn't be
     # in the repos to begin with, that will get filtered later)
     if args.update:
-        targets.update(
-            aurutils.vercmp(
-                dict((k, v) for k, v in in_repos.items() if k not in ignored)
-            )
-        )
+        targets.update(outdated.result())
     # Add out-of-date VCS packages
     vcs_updates = set()
     if args.vcs:
-        vcs_updates = set(aurutils.vercmp_devel(repos))
+        vcs_updates = outdated_vcs.result()
         targets.update(vcs_updates)
 
     # Add force rebuild packages
@@ -158,25 +178,32 @@ def process(args: argparse.Namespace):
             f"Command attempted: aur depends --table {' '.join(targets)}"
         ) from e
     # 5. Filter out:
-    filter_set = set()
     #    * Ignored packages & repositories from the command line.
-    filter_set.update(ignored)
-    #    * Packages that are already up-to-date
-    current_packages = set(
-        aurutils.vercmp_are_current(
-            packages=dict((e.package, e.pkgver) for e in depends), in_repos=in_repos
-        )
-    )
-    filter_set.update(current_packages.difference(vcs_updates))
-    #    * Things already handled by provides (and are not outdated)
-    filter_set.update(aurutils.find_provides(depends).difference(targets))
+    filter_set = set(ignored)
+    # The remaining checks run aur, so only ask about packages not already filtered
+    candidates = {e for e in depends if e.package not in filter_set}
+    if candidates:
+        # Both checks only depend on the candidates, run them in parallel
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            current = executor.submit(
+                aurutils.vercmp_are_current,
+                packages={e.package: e.pkgver for e in candidates},
+                in_repos=in_repos,
+            )
+            provided = executor.submit(aurutils.find_provides, candidates)
+        #    * Packages that are already up-to-date
+        current_packages = set(current.result())
+        filter_set.update(current_packages.difference(vcs_updates))
+        #    * Things already handled by provides (and are not outdated)
+        filter_set.update(provided.result().difference(targets))
     #    * Useless dependencies that shouldn't be included any longer
     # TODO!
 
     #    * But we do want to build force-rebuild entries
     filter_set.difference_update(args.force_rebuild)
+    filter_set = frozenset(filter_set)
 
-    targets_depends = set(e.pkgbase for e in depends)
+    targets_depends = {e.pkgbase for e in depends}
     targets_depends.difference_update(filter_set)
     _LOGGER.debug(
         "End of step 5: target_depends=%r, filter_set=%r",
@@ -208,28 +235,72 @@ def process(args: argparse.Namespace):
     # NOTE! We need to build a graph for all local packages, otherwise we cannot handle dependencies
     #       that are not mentioned in the configuration file correctly: If we are upgrading just the
     #       dependency we would otherwise have no way of knowing who depends on the package.
-    pkgbases_in_aurdest = set(e.name for e in aurutils.aurdest().iterdir())
-    dep_graph = aurutils.graph(targets_depends.union(pkgbases_in_aurdest))
-    if not nx.is_directed_acyclic_graph(dep_graph):
-        raise UserErrorMessage("AIEE! Cycles in dependency graph! Giving up!")
+    # NOTE! networkx is slow to import, so it is only imported once we get this far.
+    import networkx as nx
+
+    aur_dest = aurutils.aurdest()
+    with os.scandir(aur_dest) as it:
+        pkgbases_in_aurdest = {e.name for e in it}
+    dep_graph = aurutils.cached_graph(
+        targets_depends.union(pkgbases_in_aurdest), cache_dir=runtime_dir()
+    )
+    # The topological order doubles as the check for cycles, and is reused later.
+    # Ties are broken by name, so the order (and build.ninja) is stable between runs.
+    try:
+        topo_order = list(nx.lexicographical_topological_sort(dep_graph))
+    except nx.NetworkXUnfeasible as e:
+        raise UserErrorMessage("AIEE! Cycles in dependency graph! Giving up!") from e
     # 9. Build pkgbase mapping
     pkg_base_rev_map = pkgbase_mapping(depends)
     # 10. Figure out settings for each package (for aur build)
     build_settings = generate_build_settings(
-        dep_graph, pkg_base_rev_map, sync_config, targets_depends
+        dep_graph, pkg_base_rev_map, sync_config, targets_depends, topo_order
     )
     _LOGGER.debug("End of step 10: build_settings=%r", build_settings)
     # 11. Build a ninja file
     build_with_ninja(
-        args, build_settings, dep_graph, targets_depends, repos, sync_config
+        args,
+        build_settings,
+        dep_graph,
+        targets_depends,
+        repos,
+        sync_config,
+        aur_dest,
+        topo_order,
     )
 
 
+def _dependency_settings(
+    repo: str, build_flags: Mapping[str, Sequence[str]]
+) -> PackageSettings:
+    """Build settings for a dependency without a configuration of its own"""
+    # Assume chroot okay unless overridden
+    return {
+        "repo": repo,
+        "chroot": True,
+        "build_flags": build_flags[repo],
+    }
+
+
+def _unique_configs(configs: Iterable[PackageSettings]) -> list[PackageSettings]:
+    """Remove duplicate package settings, preserving order
+
+    Package settings are dicts and thus not hashable, compare by equality instead.
+    There are only ever a few configs per pkgbase, so a linear search is fine.
+    """
+    result: list[PackageSettings] = []
+    for config in configs:
+        if config not in result:
+            result.append(config)
+    return result
+
+
 def generate_build_settings(
-    dep_graph: nx.DiGraph,
+    dep_graph: "nx.DiGraph",
     pkg_base_rev_map: dict[str, set[str]],
     sync_config: SyncConfig,
     targets_depends: set[str],
+    topo_order: Sequence[str] | None = None,
 ):
     """Figure out build settings for each package. For packages in the config this is easy.
     This tries to figure out sensible settings for dependencies as well.
@@ -238,30 +309,36 @@ def generate_build_settings(
     :param pkg_base_rev_map: Mapping from pkgbase to package names
     :param sync_config: Program config
     :param targets_depends: Packages we are planning to build
+    :param topo_order: Topological order of dep_graph, computed if needed and not given
     :return: A mapping from pkgbase to build settings for those packages.
     """
     build_settings: dict[str, PackageSettings] = {}
     build_flags = sync_config["build_flags"]
     pkg_configs = sync_config["package_overrides"]
+    # Home repository of each configured package
+    repo_of = {k: v["repo"] for k, v in pkg_configs.items() if "repo" in v}
+    # Only computed if some dependency needs it
+    dependents: dict[str, set[str]] | None = None
     for target in targets_depends:
         pkg_names = pkg_base_rev_map[target]
-        possible_pconfs = filter(
-            lambda x: x is not None,
-            (pkg_configs.get(pname, None) for pname in pkg_names),
-        )
-        pconfs = list(unique_everseen(possible_pconfs))
+        possible_pconfs = (pkg_configs.get(pname) for pname in pkg_names)
+        pconfs = _unique_configs(p for p in possible_pconfs if p is not None)
 
         if len(pconfs) == 1:
             pconf = one(pconfs)
             build_settings[target] = pconf
         elif len(pconfs) == 0:
             # This is pulled in as a dependency of something, figure out what
-            parents = nx.descendants(dep_graph, target)
+            # Edges go from dependency to dependent, so the parents are the descendants
+            if dependents is None:
+                dependents = ancestors_closure(
+                    dep_graph.reverse(copy=False),
+                    None if topo_order is None else topo_order[::-1],
+                )
+            parents = dependents[target]
             _LOGGER.debug("Dependency %s, found %r as parents", target, parents)
             # Figure out which repository it should go in.
-            repo_candidates = set(
-                pkg_configs[e]["repo"] for e in parents if e in pkg_configs
-            )
+            repo_candidates = {repo_of[e] for e in parents if e in repo_of}
             if len(repo_candidates) == 0:
                 # Check if we have this dependency already in a repo on the system, if so use the same repo.
                 pkg_results = find_package_repo(target)
@@ -271,13 +348,8 @@ def generate_build_settings(
                         f"Reason: Candidates are (based on existing package): {pkg_results}. "
                         "Manual configuration required"
                     )
-                # Assume chroot okay unless overridden
                 repo = one(pkg_results)[0]
-                build_settings[target] = {
-                    "repo": repo,
-                    "chroot": True,
-                    "build_flags": build_flags[repo],
-                }
+                build_settings[target] = _dependency_settings(repo, build_flags)
             elif len(repo_candidates) > 1:
                 raise UserErrorMessage(
                     f"Package {target} is pulled in as a dependency, but it isn't clear which repo to put it. "
@@ -285,13 +357,8 @@ def generate_build_settings(
                     "Manual configuration required"
                 )
             else:
-                # Assume chroot okay unless overridden
                 repo = one(repo_candidates)
-                build_settings[target] = {
-                    "repo": repo,
-                    "chroot": True,
-                    "build_flags": build_flags[repo],
-                }
+                build_settings[target] = _dependency_settings(repo, build_flags)
         else:
             raise UserErrorMessage(
                 f"Inconsistent configurations found for (possibly split?) package {target}: {pconfs}"
@@ -302,10 +369,12 @@ def generate_build_settings(
 def build_with_ninja(
     args: argparse.Namespace,
     build_settings: Mapping[str, PackageSettings],
-    dep_graph: nx.DiGraph,
+    dep_graph: "nx.DiGraph",
     package_queue: Collection[str],
     repos: Mapping[str, FileRepo],
     sync_config: SyncConfig,
+    src_dir: Path,
+    topo_order: Sequence[str],
 ):
     """Create a ninja file and build using it
 
@@ -315,29 +384,27 @@ def build_with_ninja(
     :param package_queue: Queue of packages to build
     :param repos: File repositories from pacman.conf
     :param sync_config: Program configuration
+    :param src_dir: This should be aurdest()
+    :param topo_order: Topological order of dep_graph
     """
-    tmp_base = Path(f"/run/user/{os.getuid()}/aurutilsutils")
-    tmp_base.mkdir(parents=True, mode=0o700, exist_ok=True)
-    tmp_path = Path(tempfile.mkdtemp(dir=tmp_base, prefix="ninja-"))
+    tmp_path = Path(tempfile.mkdtemp(dir=runtime_dir(), prefix="ninja-"))
     build_success = False
     try:
         ninja_contents = ninja_gen.generate(
-            packages=package_queue,
+            # Emit the packages in build order, for a more readable file
+            packages=[p for p in topo_order if p in package_queue],
             repos=repos,
             configs=build_settings,
             dependency_graph=dep_graph,
-            src_dir=aurutils.aurdest(),
+            src_dir=src_dir,
             forced=args.force_rebuild,
+            topo_order=topo_order,
         )
-        with (tmp_path / "build.ninja").open(mode="wt") as f:
-            f.write(ninja_contents)
+        (tmp_path / "build.ninja").write_bytes(ninja_contents.encode("utf-8"))
         print(f"Temporary ninja directory: {tmp_path}")
         if args.build:
-            result = subprocess.run(
-                ["ninja", "-k0"],
-                cwd=tmp_path,
-                env={"NINJA_STATUS": "[%s/%t] ", **os.environ},
-            )
+            ninja_env = {"NINJA_STATUS": "[%s/%t] ", **os.environ}
+            result = subprocess.run(["ninja", "-k0"], cwd=tmp_path, env=ninja_env)
             if result.returncode == 0:
                 build_success = True
             else:
@@ -345,7 +412,11 @@ def build_with_ninja(
                 print(f"---")
                 print(f"    Temporary ninja directory: {tmp_path}")
                 print(f"---")
-                new_result = subprocess.run(
+                # Read the build directory once rather than stat each stamp file
+                with os.scandir(tmp_path) as it:
+                    existing = {e.name for e in it}
+                # Process the dry-run output as it arrives
+                with subprocess.Popen(
                     [
                         "ninja",
                         "-n",
@@ -354,29 +425,26 @@ def build_with_ninja(
                         "-f",
                         str(tmp_path / "build.ninja"),
                     ],
-                    env={"NINJA_STATUS": "[%s/%t] ", **os.environ},
+                    env=ninja_env,
                     encoding="utf-8",
                     stdout=subprocess.PIPE,
-                )
-                _RE_STAMP = regex.compile(
-                    r"(\[\d+/\d+\] )(.+?)([\w@\.\-\+]+)(\.stamp)", regex.VERSION1
-                )
-                for line in new_result.stdout.splitlines():
-                    if match := _RE_STAMP.search(line):
-                        status = match.group(1)
-                        pkg = match.group(3)
-                        if (tmp_path / pkg).exists():
-                            print_formatted_text(
-                                HTML(
-                                    "{status} <b>{pkg}</b>\t<ansigreen>OK</ansigreen>"
-                                ).format(status=status, pkg=pkg)
-                            )
-                        else:
-                            print_formatted_text(
-                                HTML(
-                                    "{status} <b>{pkg}</b>\t<ansired>FAIL</ansired>"
-                                ).format(status=status, pkg=pkg)
-                            )
+                ) as proc:
+                    for line in proc.stdout:
+                        if match := _RE_STAMP.search(line):
+                            status = match.group(1)
+                            pkg = match.group(3)
+                            if f"{pkg}{match.group(4)}" in existing:
+                                print_formatted_text(
+                                    HTML(
+                                        "{status} <b>{pkg}</b>\t<ansigreen>OK</ansigreen>"
+                                    ).format(status=status, pkg=pkg)
+                                )
+                            else:
+                                print_formatted_text(
+                                    HTML(
+                                        "{status} <b>{pkg}</b>\t<ansired>FAIL</ansired>"
+                                    ).format(status=status, pkg=pkg)
+                                )
     finally:
         if not args.debug and args.build and build_success:
             shutil.rmtree(tmp_path)
@@ -1,23 +1,34 @@
 import logging
-from typing import Mapping
+from collections.abc import Sequence
+from typing import Collection, Mapping, TYPE_CHECKING
 
 from ..utils.pacman import FileRepo
 from ..utils.settings import SyncConfig
 
+if TYPE_CHECKING:
+    import networkx as nx
+
 _LOGGER = logging.getLogger(name=__name__)
 
 
 def find_packages_to_have(
-    repos: Mapping[str, FileRepo], sync_config: SyncConfig
+    repos: Mapping[str, FileRepo],
+    sync_config: SyncConfig,
+    *,
+    ignored_repos: Collection[str] = (),
 ) -> set[str]:
     """Find all packages we should have according to the config (and repositories that exist on this machine).
 
     :param repos: Repositories on this machine
     :param sync_config: Sync config with everything that should exist
+    :param ignored_repos: Repos ignored on the command line.
     :return: Set of AUR packages that we should have
     """
     results = set()
     for repo, entries in sync_config["repositories"].items():
+        if repo in ignored_repos:
+            _LOGGER.info("Skipping %s: repo ignored on command line", repo)
+            continue
         if repo not in repos:
             _LOGGER.info("Skipping %s: repo doesn't exist on this machine", repo)
             continue
@@ -35,3 +46,30 @@ def find_packages_in_config(sync_config: SyncConfig) -> set[str]:
     for entries in sync_config["repositories"].values():
         results.update(entries)
     return results
+
+
+def ancestors_closure(
+    graph: "nx.DiGraph", topo_order: Sequence[str] | None = None
+) -> dict[str, set[str]]:
+    """Find all (transitive) ancestors of every node in the graph
+
+    This is done in a single pass in topological order, instead of one graph
+    traversal per node. Edges go from dependency to dependent, so this finds the
+    dependencies. Pass graph.reverse(copy=False) and the reversed order to find
+    the dependents instead.
+
+    :param graph: The graph
+    :param topo_order: Topological order of graph, computed if not given
+    """
+    if topo_order is None:
+        import networkx as nx
+
+        topo_order = list(nx.topological_sort(graph))
+    ancestors: dict[str, set[str]] = {}
+    for node in topo_order:
+        result = set()
+        for predecessor in graph.predecessors(node):
+            result.add(predecessor)
+            result.update(ancestors[predecessor])
+        ancestors[node] = result
+    return ancestors
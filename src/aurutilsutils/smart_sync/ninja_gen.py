@@ -1,26 +1,41 @@
 import shlex
-from collections.abc import Collection, Mapping
+from collections.abc import Collection, Mapping, Sequence
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import networkx as nx
-
+from .helpers import ancestors_closure
 from ..utils.pacman import FileRepo
 from ..utils.settings import PackageSettings
 
+if TYPE_CHECKING:
+    import networkx as nx
+
+
+# There are only four variants of the build rule, so generate them up front
+_RULE_COMMANDS = {
+    (chroot, force): "    command = env -C ${directory} -- aur build "
+    + " ".join(
+        [
+            "--clean",
+            "--syncdeps",
+            "-d",
+            "${repo}",
+            "--root",
+            "${root}",
+            "--chroot" if chroot else "--rmdeps",
+            *(["--force"] if force else []),
+        ]
+    )
+    + " ${build_flags} && date --rfc-3339=ns > ${out}"
+    for chroot in (False, True)
+    for force in (False, True)
+}
 
-def gen_build_rule(chroot: bool, force: bool):
-    yield f"rule aurbuild_{chroot}_{force}"
-    args = ["--clean", "--syncdeps", "-d", "${repo}", "--root", "${root}"]
-    if chroot:
-        args.append("--chroot")
-    else:
-        args.append("--rmdeps")
-    if force:
-        args.append("--force")
-    yield "    command = env -C ${directory} -- aur build " + " ".join(
-        args
-    ) + " ${build_flags} && date --rfc-3339=ns > ${out}"
-    yield "    pool = console"
+
+def gen_build_rule(chroot: bool, force: bool, out: list[str]):
+    out.append(f"rule aurbuild_{chroot}_{force}")
+    out.append(_RULE_COMMANDS[(chroot, force)])
+    out.append("    pool = console")
 
 
 def gen_build_command(
@@ -30,50 +45,59 @@ def gen_build_command(
     package_config: PackageSettings,
     force: bool,
     depends: list[str],
+    out: list[str],
 ):
     fmt_depends = " ".join(f"{d}.stamp" for d in depends)
     pkgbuild_path = pkgbuild_dir / "PKGBUILD"
-    yield f"build {package}.stamp: aurbuild_{package_config['chroot']}_{force} {pkgbuild_path} | {fmt_depends}"
-    yield f"    directory = {str(pkgbuild_dir)}"
-    yield f"    repo = {repo.name}"
-    yield f"    root = {repo.root}"
-    yield f"    build_flags = {' '.join(shlex.quote(e) for e in package_config['build_flags'])}"
+    out.append(
+        f"build {package}.stamp: aurbuild_{package_config['chroot']}_{force} {pkgbuild_path} | {fmt_depends}"
+    )
+    out.append(f"    directory = {str(pkgbuild_dir)}")
+    out.append(f"    repo = {repo.name}")
+    out.append(f"    root = {repo.root}")
+    out.append(
+        f"    build_flags = {' '.join(shlex.quote(e) for e in package_config['build_flags'])}"
+    )
 
 
 def generate(
-    packages: Collection[str],
+    packages: Sequence[str],
     repos: Mapping[str, FileRepo],
     configs: Mapping[str, PackageSettings],
-    dependency_graph: nx.DiGraph,
+    dependency_graph: "nx.DiGraph",
     src_dir: Path,
     forced: Collection[str],
+    topo_order: Sequence[str] | None = None,
 ):
     """Generate ninja build file
 
-    :param packages: Packages to process
+    :param packages: Packages to process, in the order they should appear in the file
     :param repos: Repository descriptions
     :param configs: Package configurations to determine home repos and chroot status
     :param dependency_graph: Dependency graph to use for ninja
     :param src_dir: This should be aurdest()
     :param forced: Forced packages
+    :param topo_order: Topological order of dependency_graph, computed if not given
     :return: File contents
     """
+    package_set = frozenset(packages)
+    ancestors = ancestors_closure(dependency_graph, topo_order)
 
-    def _generator():
-        yield from gen_build_rule(False, False)
-        yield from gen_build_rule(True, False)
-        yield from gen_build_rule(False, True)
-        yield from gen_build_rule(True, True)
-        for package in sorted(packages):
-            cfg = configs[package]
-            repo = cfg["repo"]
-            yield from gen_build_command(
-                package=package,
-                pkgbuild_dir=src_dir / package,
-                repo=repos[repo],
-                package_config=cfg,
-                depends=nx.ancestors(dependency_graph, package).intersection(packages),
-                force=package in forced,
-            )
-
-    return "\n".join(_generator()) + "\n"
+    out: list[str] = []
+    gen_build_rule(False, False, out)
+    gen_build_rule(True, False, out)
+    gen_build_rule(False, True, out)
+    gen_build_rule(True, True, out)
+    for package in packages:
+        cfg = configs[package]
+        repo = cfg["repo"]
+        gen_build_command(
+            package=package,
+            pkgbuild_dir=src_dir / package,
+            repo=repos[repo],
+            package_config=cfg,
+            depends=sorted(ancestors[package] & package_set),
+            force=package in forced,
+            out=out,
+        )
+    return "\n".join(out) + "\n"
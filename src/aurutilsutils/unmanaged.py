@@ -2,6 +2,7 @@
 """Script to find things that need to be updated in smart-sync config"""
 import argparse
 import logging
+import os
 
 import networkx as nx
 from prompt_toolkit import print_formatted_text, HTML
@@ -49,15 +50,17 @@ def process():
     # 3. Find what is in the repositories we have.
     # Mapping from package name to version string, but we only care about the names here
     in_repos = packages_in_repos_full(repos)
-    in_repos_pkgbase = set(e.pkgbase for e in in_repos)
 
     # Try to resolve to pkgbase (aur depends can't use it so we need to use pkgnames in config, not pkgbase)
-    pkgbases_in_config, _ = resolve_pkgbase(in_repos, pkgs_in_config)
+    # This also maps the pkgbases in the repos, saving a separate pass over them.
+    pkgbases_in_config, _, _, base_to_pkgs = resolve_pkgbase(in_repos, pkgs_in_config)
+    in_repos_pkgbase = set(base_to_pkgs)
 
     # Just diffing the two sets does not suffice, we need to resolve dependencies next
 
     # However, not all packages may exist locally in aurdest (which is needed for graph)!
-    pkgbases_in_aurdest = set(e.name for e in aurutils.aurdest().iterdir())
+    with os.scandir(aurutils.aurdest()) as it:
+        pkgbases_in_aurdest = {e.name for e in it}
 
     dep_graph = aurutils.graph(in_repos_pkgbase.intersection(pkgbases_in_aurdest))
     dep_graph.add_nodes_from(pkgbases_in_config)
@@ -1,3 +1,15 @@
+import functools
+import logging
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Any
+
+_LOGGER = logging.getLogger(name=__name__)
+
+
+@functools.cache
 def get_version():
     """Get the version of aurutilsutils"""
     try:
@@ -6,3 +18,53 @@ def get_version():
         return _version.__version__
     except ImportError:
         return "unknown version"
+
+
+def runtime_dir() -> Path:
+    """Get (and create if needed) the per-user runtime directory of aurutilsutils"""
+    path = Path(f"/run/user/{os.getuid()}/aurutilsutils")
+    path.mkdir(parents=True, mode=0o700, exist_ok=True)
+    return path
+
+
+def load_pickle(path: Path) -> Any | None:
+    """Load a pickled cache file
+
+    :param path: File to load
+    :return: The unpickled object, or None if the file is missing or unusable
+    """
+    try:
+        with path.open(mode="rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (
+        pickle.UnpicklingError,
+        EOFError,
+        AttributeError,
+        ImportError,
+        TypeError,
+        ValueError,
+    ) as e:
+        # This also covers objects pickled by an older version of a library
+        _LOGGER.info("Ignoring broken cache file %s: %s", path, e)
+        return None
+
+
+def dump_pickle_atomic(path: Path, obj: Any) -> None:
+    """Atomically replace path with the pickled object
+
+    :param path: File to write
+    :param obj: Object to pickle
+    """
+    # Use a unique temporary file, so concurrent runs don't write into the same file
+    with tempfile.NamedTemporaryFile(
+        mode="wb", dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False
+    ) as f:
+        tmp_file = Path(f.name)
+        try:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
+    tmp_file.replace(path)
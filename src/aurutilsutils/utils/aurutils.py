@@ -1,25 +1,41 @@
 """Utilities for using aurutils"""
+import asyncio
 import dataclasses
+import functools
+import hashlib
 import logging
 import os
 import subprocess
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Collection, Mapping
+from typing import Collection, Iterator, Mapping, TYPE_CHECKING
 
 import appdirs
-import networkx as nx
 
+from . import dump_pickle_atomic, load_pickle, runtime_dir
 from .errors import CommandException, InternalError
 from .pacman import FileRepo
 from .shell import run_out, run_inout, run_in, run
 
+if TYPE_CHECKING:
+    import networkx as nx
+
 _LOGGER = logging.getLogger(name=__name__)
 
+# Upper limit on concurrent .SRCINFO reads
+_MAX_READ_WORKERS = 8
+
+
+@functools.cache
+def _aur_config_dir() -> Path:
+    """Get the aurutils configuration directory"""
+    return Path(appdirs.user_config_dir("aurutils"))
+
 
 def file_ignores():
     """Load file based ignore list from aurutils"""
-    ignore_file = Path(appdirs.user_config_dir("aurutils")) / "sync/ignore"
+    ignore_file = _aur_config_dir() / "sync/ignore"
     if not ignore_file.exists():
         return []
     with ignore_file.open(mode="rt", encoding="utf-8") as f:
@@ -28,6 +44,7 @@ def file_ignores():
         # TODO: Use this file
 
 
+@functools.cache
 def aurdest() -> Path:
     """Get AURDEST directory"""
     if result := os.getenv("AURDEST"):
@@ -35,9 +52,15 @@ def aurdest() -> Path:
     return Path(appdirs.user_cache_dir("aurutils")) / "sync"
 
 
+@functools.cache
 def order_file() -> Path:
     """Path to order file for diffs"""
-    return Path(appdirs.user_config_dir("aurutils")) / "sync/orderfile"
+    return _aur_config_dir() / "sync/orderfile"
+
+
+def _read_table(output: str) -> Iterator[list[str]]:
+    """Split tab separated aurutils output into rows, skipping empty lines"""
+    return (line.split("\t") for line in output.splitlines() if line)
 
 
 def list_repo(repo: FileRepo) -> dict[str, str]:
@@ -45,10 +68,10 @@ def list_repo(repo: FileRepo) -> dict[str, str]:
     output = run_out(
         ["aur", "repo", "--list", f"--database={repo.name}", f"--root={repo.root}"]
     )
-    return dict(tuple[str, str](e.split("\t", maxsplit=1)) for e in output.splitlines())
+    return dict(e.split("\t", maxsplit=1) for e in output.splitlines() if e)
 
 
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass(frozen=True, slots=True)
 class PkgInfo:
     package: str
     depends: str
@@ -61,16 +84,8 @@ def list_repo_full(repo: FileRepo):
     output = run_out(
         ["aur", "repo", "--table", f"--database={repo.name}", f"--root={repo.root}"]
     )
-    for line in output.splitlines():
-        if not line:
-            continue
-        sline = line.split("\t")
-        yield PkgInfo(
-            package=sline[0],
-            depends=sline[1],
-            pkgbase=sline[2],
-            pkgver=sline[3],
-        )
+    for row in _read_table(output):
+        yield PkgInfo(*row[:4])
 
 
 def vercmp(packages: Mapping[str, str]) -> list[str]:
@@ -86,7 +101,7 @@ def vercmp_are_current(
     packages: Mapping[str, str], in_repos: Mapping[str, str]
 ) -> list[str]:
     """Find packages that are already up-to-date locally"""
-    with tempfile.NamedTemporaryFile(mode="w+t") as in_repos_file:
+    with tempfile.NamedTemporaryFile(mode="w+t", dir=runtime_dir()) as in_repos_file:
         in_repos_file.writelines(f"{k}\t{v}\n" for k, v in in_repos.items())
         in_repos_file.write("\n")
         in_repos_file.flush()
@@ -97,7 +112,7 @@ def vercmp_are_current(
     return output.splitlines()
 
 
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass(frozen=True, slots=True)
 class DependencyInfo:
     package: str
     depends: str
@@ -106,29 +121,32 @@ class DependencyInfo:
     depends_type: str
 
 
-def depends(packages: Collection[str]):
+def _depends_table(packages: Collection[str]) -> Iterator[list[str]]:
+    """Rows of aur depends --table output for the given packages"""
     # output = _test_data.splitlines()
     output, _ = run_inout(
         ["aur", "depends", "--table", "-"], "\n".join(packages) + "\n"
     )
-    for line in output.splitlines():
-        if not line:
-            continue
-        sline = line.split("\t")
-        yield DependencyInfo(
-            package=sline[0],
-            depends=sline[1],
-            pkgbase=sline[2],
-            pkgver=sline[3],
-            depends_type=sline[4],
-        )
+    return _read_table(output)
+
+
+def depends(packages: Collection[str]):
+    for row in _depends_table(packages):
+        yield DependencyInfo(*row[:5])
+
+
+def depends_pkgbases(packages: Collection[str]) -> Iterator[tuple[str, str]]:
+    """Like depends(), but only yield (package, pkgbase) pairs"""
+    for row in _depends_table(packages):
+        yield row[0], row[2]
 
 
 def find_provides(dependency_info: set[DependencyInfo]):
     """Find provides that can replace the listed dependencies"""
     output, stderr = run_inout(
         ["aur", "repo-filter", "--sync"],
-        "\n".join(set(e.package for e in dependency_info)) + "\n",
+        # Deduplicate, keeping the order the packages were first seen in
+        "\n".join(dict.fromkeys(e.package for e in dependency_info)) + "\n",
     )
     for line in stderr.splitlines():
         _LOGGER.info("Provides: %s", line)
@@ -137,7 +155,7 @@ def find_provides(dependency_info: set[DependencyInfo]):
 
 def fetch(queue: Collection[str]):
     """Implements the aur fetch call"""
-    with tempfile.NamedTemporaryFile(mode="rt") as results_file:
+    with tempfile.NamedTemporaryFile(mode="rt", dir=runtime_dir()) as results_file:
         run_in(
             [
                 "aur",
@@ -168,7 +186,7 @@ def fetch(queue: Collection[str]):
 
 def view(packages: Collection[str]) -> bool:
     """Implements calls to aur view"""
-    with tempfile.NamedTemporaryFile(mode="wt") as queue_file:
+    with tempfile.NamedTemporaryFile(mode="wt", dir=runtime_dir()) as queue_file:
         queue_file.write("\n".join(packages))
         queue_file.write("\n")
         queue_file.flush()
@@ -183,49 +201,106 @@ def view(packages: Collection[str]) -> bool:
 def graph(packages: Collection[str]):
     # Read in all .SRCINFO files and concatenate them
     aur_dest = aurdest()
-    lines: list[str] = []
-    for package in packages:
-        with (aur_dest / package / ".SRCINFO").open(mode="rt", encoding="utf-8") as f:
-            lines.extend(e.rstrip("\n") for e in f.readlines())
+    # Reads are overlapped in a thread pool, map() keeps the output deterministic
+    with ThreadPoolExecutor(max_workers=_MAX_READ_WORKERS) as executor:
+        srcinfos = executor.map(
+            lambda package: (aur_dest / package / ".SRCINFO").read_text(
+                encoding="utf-8"
+            ),
+            packages,
+        )
+        chunks = [e.removesuffix("\n") for e in srcinfos if e]
     # Feed this data to aur-graph:
     try:
-        out, err = run_inout(["aur", "graph"], input_data="\n".join(lines) + "\n")
+        out, err = run_inout(["aur", "graph"], input_data="\n".join(chunks) + "\n")
     except CommandException as e:
         raise InternalError("Failed to verify dependency graph") from e
-    # Build a dependency graph
-    g = nx.DiGraph()
+    # Build a dependency graph (networkx is slow to import, only do so when needed)
+    import networkx as nx
+
+    # Collect everything first and insert in bulk, that is much cheaper in networkx
+    nodes: list[str] = []
+    edges: list[tuple[str, str]] = []
     for line in out.splitlines():
         partial_ordering = line.split("\t")
         assert len(partial_ordering) == 2
         if partial_ordering[0] == partial_ordering[1]:
-            g.add_node(partial_ordering[0])
+            nodes.append(partial_ordering[0])
             continue
-        g.add_edge(partial_ordering[1], partial_ordering[0])
+        edges.append((partial_ordering[1], partial_ordering[0]))
+    g = nx.DiGraph()
+    g.add_nodes_from(nodes)
+    g.add_edges_from(edges)
     return g
 
 
+def cached_graph(packages: Collection[str], *, cache_dir: Path) -> "nx.DiGraph":
+    """Like graph(), but reuse the result of an earlier run if no .SRCINFO changed
+
+    :param packages: Packages to build the graph for
+    :param cache_dir: Directory to store the cached graph in
+    :return: Dependency graph
+    """
+    # Fingerprint the input using the metadata of the .SRCINFO files
+    aur_dest = aurdest()
+    fingerprint = hashlib.blake2b(digest_size=16)
+    for package in sorted(packages):
+        info = (aur_dest / package / ".SRCINFO").stat()
+        fingerprint.update(f"{package}\t{info.st_mtime_ns}\t{info.st_size}\n".encode())
+    cache_file = cache_dir / f"graph-{fingerprint.hexdigest()}.pkl"
+    if (g := load_pickle(cache_file)) is not None:
+        return g
+    g = graph(packages)
+    # Only keep the latest graph around
+    for old_file in cache_dir.glob("graph-*.pkl"):
+        old_file.unlink(missing_ok=True)
+    dump_pickle_atomic(cache_file, g)
+    return g
+
+
+async def _vercmp_devel_repo(repo: str) -> list[str]:
+    """Run aur vercmp-devel for a single repo, returning the outdated packages"""
+    proc = await asyncio.create_subprocess_exec(
+        "aur",
+        "vercmp-devel",
+        "-d",
+        repo,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        stdin=asyncio.subprocess.DEVNULL,
+    )
+
+    async def outdated() -> list[str]:
+        return [
+            line.split(b" ", maxsplit=1)[0].decode("utf-8")
+            async for line in proc.stdout
+            if line.strip()
+        ]
+
+    # Drain both pipes as output arrives, so no process stalls on a full pipe
+    packages, stderr = await asyncio.gather(outdated(), proc.stderr.read())
+    await proc.wait()
+    if proc.returncode != 0:
+        raise CommandException(
+            f"aur vercmp-devel failed for repo {repo}",
+            proc.returncode,
+            stderr.decode("utf-8"),
+        )
+    return packages
+
+
+async def _vercmp_devel_all(repos: Collection[str]) -> list[str]:
+    results = await asyncio.gather(
+        *(_vercmp_devel_repo(repo) for repo in repos), return_exceptions=True
+    )
+    # Every process has finished by now, report the first failure in repo order
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return [pkg for packages in results for pkg in packages]
+
+
 def vercmp_devel(repos: Mapping[str, FileRepo]):
     """Find set of outdated packages"""
     # Run in parallel for speed
-    results = [
-        (
-            repo,
-            subprocess.Popen(
-                ["aur", "vercmp-devel", "-d", repo],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                stdin=subprocess.DEVNULL,
-                encoding="utf-8",
-            ),
-        )
-        for repo in repos.keys()
-    ]
-    for repo, result in results:
-        stdout, stderr = result.communicate()
-        if result.returncode != 0:
-            raise CommandException(
-                f"aur vercmp-devel failed for repo {repo}", result.returncode, stderr
-            )
-        for line in stdout.splitlines():
-            pkg, _ = line.split(" ", maxsplit=1)
-            yield pkg
+    yield from asyncio.run(_vercmp_devel_all(repos.keys()))
@@ -2,16 +2,28 @@ import contextlib
 import logging
 import sys
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Collection, Mapping
 
+import appdirs
 from prompt_toolkit import print_formatted_text, HTML
 
-from . import aurutils
+from . import aurutils, dump_pickle_atomic, load_pickle
 from .errors import UserErrorMessage, FormattedException
 from .pacman import FileRepo
 
 _LOGGER = logging.getLogger(name=__name__)
 
+# Bump this when the format of the repository cache changes
+_REPO_CACHE_VERSION = 2
+
+# Repository name -> (repository database stat key, packages in repository)
+_RepoCache = dict[str, tuple[tuple[str, int, int], list[aurutils.PkgInfo]]]
+
+# Upper limit on concurrent aur-repo processes
+_MAX_REPO_WORKERS = 8
+
 
 def pkgbase_mapping(
     depends: Collection[aurutils.DependencyInfo],
@@ -36,63 +48,127 @@ def packages_in_repos(
 
     :return: Mapping from package name to package version
     """
+    wanted = [repo for repo in repos.values() if repo.name not in ignored_repos]
     in_repos: dict[str, str] = {}
-    for repo in repos.values():
-        if repo in ignored_repos:
-            continue
-        in_repos.update(aurutils.list_repo(repo))
+    if not wanted:
+        return in_repos
+    # Each repo is listed by a separate aur-repo process, run them in parallel
+    with ThreadPoolExecutor(
+        max_workers=min(_MAX_REPO_WORKERS, len(wanted))
+    ) as executor:
+        # map() preserves order, so later repos still take precedence like before
+        for listing in executor.map(aurutils.list_repo, wanted):
+            in_repos.update(listing)
     return in_repos
 
 
+def _repo_cache_file() -> Path:
+    """Path to the on-disk cache of repository contents"""
+    return Path(appdirs.user_cache_dir("aurutilsutils")) / "repocache.pkl"
+
+
+def _load_repo_cache(cache_file: Path) -> _RepoCache:
+    """Load the repository cache, returning an empty cache if missing or unusable"""
+    data = load_pickle(cache_file)
+    if not isinstance(data, tuple) or len(data) != 2:
+        return {}
+    version, cache = data
+    if version != _REPO_CACHE_VERSION:
+        return {}
+    return cache
+
+
+def _save_repo_cache(cache_file: Path, cache: _RepoCache) -> None:
+    """Atomically replace the repository cache"""
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    dump_pickle_atomic(cache_file, (_REPO_CACHE_VERSION, cache))
+
+
 def packages_in_repos_full(
     repos: Mapping[str, FileRepo], *, ignored_repos: Collection[str] = ()
 ) -> set[aurutils.PkgInfo]:
     """Find packages in local repositories on disk with full info
 
+    The contents of each repository is cached on disk, and only listed again when
+    the repository database changes.
+
     :param repos: File repositories found in pacman.conf
     :param ignored_repos: Repos ignored on the command line.
 
     :return Mapping from package name to package version
     """
+    cache_file = _repo_cache_file()
+    cache = _load_repo_cache(cache_file)
+    cache_changed = False
     in_repos: set[aurutils.PkgInfo] = set()
+    # Repositories that have to be listed again, along with their cache key
+    stale: list[tuple[FileRepo, tuple[str, int, int] | None]] = []
     for repo in repos.values():
-        if repo in ignored_repos:
+        if repo.name in ignored_repos:
             continue
-        in_repos.update(aurutils.list_repo_full(repo))
+        try:
+            db_stat = repo.path.stat()
+            key = (str(repo.path), db_stat.st_mtime_ns, db_stat.st_size)
+        except FileNotFoundError:
+            key = None
+        cached = cache.get(repo.name)
+        if key is not None and cached is not None and cached[0] == key:
+            in_repos.update(cached[1])
+        else:
+            stale.append((repo, key))
+    if stale:
+        with ThreadPoolExecutor(
+            max_workers=min(_MAX_REPO_WORKERS, len(stale))
+        ) as executor:
+            listings = executor.map(
+                lambda repo: list(aurutils.list_repo_full(repo)),
+                (repo for repo, _ in stale),
+            )
+            for (repo, key), packages in zip(stale, listings):
+                in_repos.update(packages)
+                if key is not None:
+                    cache[repo.name] = (key, packages)
+                    cache_changed = True
+    if cache_changed:
+        _save_repo_cache(cache_file, cache)
     return in_repos
 
 
 def resolve_pkgbase(
     in_repos: Collection[aurutils.PkgInfo], pkgs_in_config: Collection[str]
-) -> tuple[set[str], dict[str, str]]:
+) -> tuple[set[str], dict[str, str], dict[str, aurutils.PkgInfo], dict[str, set[str]]]:
     """Attempt to resolve pkgbase info, first using local info, and then reaching out to aur
 
     :param in_repos: Information on packages in local repositories
     :param pkgs_in_config: Packages in config we want to find pkgbase names for
 
-    :return: Set of pkgbases corresponding to pkgs_in_config, and mapping from pkgname to pkgbase
+    :return: Set of pkgbases corresponding to pkgs_in_config, mapping from pkgname to pkgbase,
+             and (for local packages only) mapping from pkgname to package info, as well as
+             from pkgbase to pkgnames
     """
-    pkg_base_mapping: dict[str, str] = dict((e.package, e.pkgbase) for e in in_repos)
-    pkgbases_in_config = set()
-    unknown_in_config = set()
-    for e in pkgs_in_config:
-        if e in pkg_base_mapping:
-            pkgbases_in_config.add(pkg_base_mapping[e])
-        else:
-            unknown_in_config.add(e)
+    # Build all the mappings of local packages in a single pass
+    pkg_base_mapping: dict[str, str] = {}
+    pkg_info_by_name: dict[str, aurutils.PkgInfo] = {}
+    base_to_pkgs: dict[str, set[str]] = {}
+    for pkginfo in in_repos:
+        pkg_base_mapping[pkginfo.package] = pkginfo.pkgbase
+        pkg_info_by_name[pkginfo.package] = pkginfo
+        base_to_pkgs.setdefault(pkginfo.pkgbase, set()).add(pkginfo.package)
+    config_set = set(pkgs_in_config)
+    known_in_config = config_set & pkg_base_mapping.keys()
+    unknown_in_config = config_set - known_in_config
+    pkgbases_in_config = {pkg_base_mapping[e] for e in known_in_config}
     # Try resolving the remaining pkgbases using aur depends
     if unknown_in_config:
-        depends = set(aurutils.depends(unknown_in_config))
-        pkg_base_mapping2 = dict((e.package, e.pkgbase) for e in depends)
-        for e in unknown_in_config:
-            if e in pkg_base_mapping2:
-                pkgbases_in_config.add(pkg_base_mapping2[e])
-            else:
-                _LOGGER.warning(
-                    "Unknown package in config: %s (can't find locally or on AUR)", e
-                )
+        pkg_base_mapping2 = dict(aurutils.depends_pkgbases(unknown_in_config))
+        resolved = pkg_base_mapping2.keys() & unknown_in_config
+        pkgbases_in_config.update(pkg_base_mapping2[e] for e in resolved)
+        for e in unknown_in_config - resolved:
+            _LOGGER.warning(
+                "Unknown package in config: %s (can't find locally or on AUR)", e
+            )
         pkg_base_mapping.update(pkg_base_mapping2)
-    return pkgbases_in_config, pkg_base_mapping
+    return pkgbases_in_config, pkg_base_mapping, pkg_info_by_name, base_to_pkgs
 
 
 @contextlib.contextmanager
@@ -1,19 +1,20 @@
 """Utilities for dealing with pacman"""
 import dataclasses
+import functools
+import logging
 from collections.abc import Iterable, Generator
 from pathlib import Path
 
-import regex
-
 from aurutilsutils.utils.errors import CommandException
-
-# Pattern to find section headers
 from aurutilsutils.utils.shell import run_out
 
-_RE_SECTION = regex.compile(r"\[(?P<name>[^\n]+)\].*", regex.VERSION1)
+_LOGGER = logging.getLogger(name=__name__)
 
 PacmanConfig = dict[str, dict[str, str | list[str] | None]]
 
+# Parsed pacconf output, keyed on (config_file, raw)
+_PACMAN_CONFIG_CACHE: dict[tuple[str | None, bool], PacmanConfig] = {}
+
 
 def _inner_parse_pacman_config(
     data: Iterable[str],
@@ -27,8 +28,9 @@ def _inner_parse_pacman_config(
             continue
         elif line.startswith("#"):
             continue
-        elif match := _RE_SECTION.match(line):
-            cur_section = match.group("name")
+        elif line.startswith("[") and (end := line.rfind("]")) > 1:
+            # Section header, the name extends to the last ] on the line
+            cur_section = line[1:end]
         else:
             if "=" in line:
                 key, value = line.split("=", maxsplit=1)
@@ -52,13 +54,26 @@ def _parse_pacman_config(data: Iterable[str]) -> PacmanConfig:
 
 
 def pacman_config(*, config_file: str | None = None, raw: bool = False) -> PacmanConfig:
-    """Load a pacman.conf file"""
+    """Load a pacman.conf file
+
+    The result is cached, see clear_pacman_config_cache().
+    """
+    key = (config_file, raw)
+    if (config := _PACMAN_CONFIG_CACHE.get(key)) is not None:
+        return config
     cmd = ["pacconf"]
     if config_file is not None:
         cmd += [f"--config={config_file}"]
     if raw:
         cmd += ["--raw"]
-    return _parse_pacman_config(run_out(cmd).splitlines())
+    config = _parse_pacman_config(run_out(cmd).splitlines())
+    _PACMAN_CONFIG_CACHE[key] = config
+    return config
+
+
+def clear_pacman_config_cache() -> None:
+    """Forget cached pacman configs, needed if pacman.conf is changed"""
+    _PACMAN_CONFIG_CACHE.clear()
 
 
 @dataclasses.dataclass(frozen=True)
@@ -89,8 +104,36 @@ def custom_repos(config: PacmanConfig) -> dict[str, FileRepo]:
     return repos
 
 
+@functools.cache
+def _sync_index() -> dict[str, str] | None:
+    """Mapping from package name to the first sync repo that has it
+
+    :return: None if pacman -Sl could not be run
+    """
+    try:
+        output = run_out(["pacman", "-Sl"])
+    except (CommandException, OSError) as e:
+        _LOGGER.debug("Could not list sync databases: %s", e)
+        return None
+    index: dict[str, str] = {}
+    for line in output.splitlines():
+        if not line:
+            continue
+        # Format is: repo name version [installed]
+        repo, name, *_ = line.split(" ", maxsplit=2)
+        # Repos are listed in the order they are in pacman.conf, and like pacman -S
+        # we want the first repo that has the package
+        index.setdefault(name, repo)
+    return index
+
+
 def find_package_repo(package: str) -> set[tuple[str, str]]:
     """Find which repo a package is in (if any)"""
+    # Fast path for the common case of a plain package name
+    index = _sync_index()
+    if index is not None and (repo := index.get(package)) is not None:
+        return {(repo, package)}
+    # Let pacman deal with provides, groups and so on
     try:
         pkg_results = set(
             run_out(["pacman", "-S", "--print", "--print-format", "%r|%n", package])
@@ -99,6 +142,6 @@ def find_package_repo(package: str) -> set[tuple[str, str]]:
         )
         return {tuple(e.split("|")) for e in pkg_results}
     except CommandException as e:
-        if e.stderr.contains("not found"):
+        if "not found" in (e.stderr or ""):
             return set()
         raise
@@ -1,5 +1,5 @@
 """Settings file handling"""
-import copy
+import functools
 from collections import ChainMap
 from pathlib import Path
 from typing import TypedDict
@@ -9,12 +9,24 @@ import yaml
 
 from .errors import UserErrorMessage
 
+# Use the libyaml based loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader
+
+
+@functools.cache
+def _config_dir() -> Path:
+    """Get the aurutilsutils configuration directory"""
+    return Path(appdirs.user_config_dir("aurutilsutils"))
+
 
 def load_settings(file: str):
-    file_path = Path(appdirs.user_config_dir("aurutilsutils")) / (file + ".yml")
+    file_path = _config_dir() / (file + ".yml")
     try:
         with file_path.open(mode="rt") as f:
-            return yaml.safe_load(f)
+            return yaml.load(f, Loader=_SafeLoader)
     except FileNotFoundError as e:
 
         raise UserErrorMessage(
@@ -34,20 +46,21 @@ class PackageSettings(TypedDict, total=False):
     # Which repo this belongs to. Note! This should not be in config, but is computed internally
     repo: str
     # Build flags. Note! This should not be in config, but is computed internally from repo data
-    build_flags: list[str]
+    build_flags: tuple[str, ...]
 
 
 class SyncConfig(TypedDict):
     """Sync settings"""
 
-    # A list of flags to always pass to aur-build
-    build_flags: dict[str, list[str]]
+    # A list of flags to always pass to aur-build (resolved to tuples per repository)
+    build_flags: dict[str, list[str] | tuple[str, ...]]
     # Mapping from repository name to packages in said repository
     repositories: dict[str, list[str]]
     # Package overrides
     package_overrides: dict[str, PackageSettings]
 
 
+@functools.cache
 def load_sync_settings() -> SyncConfig:
     """Load the sync configuration file"""
     settings = load_settings("sync")
@@ -75,11 +88,18 @@ def _fixup_package_configs(sync_config: SyncConfig) -> None:
         pkg_configs[package] = data2
     # We annotate each package with the repository it belongs to.
     for repo, entries in sync_config["repositories"].items():
+        repo_flags = build_flags[repo]
+        default_for_repo: PackageSettings = {
+            **default_package_settings,
+            "repo": repo,
+            "build_flags": repo_flags,
+        }
         for pkg in entries:
-            if pkg not in pkg_configs:
-                pkg_configs[pkg] = copy.copy(default_package_settings)
-            pkg_configs[pkg]["repo"] = repo
-            pkg_configs[pkg]["build_flags"] = build_flags[repo]
+            if (pkg_config := pkg_configs.get(pkg)) is None:
+                pkg_configs[pkg] = dict(default_for_repo)
+            else:
+                pkg_config["repo"] = repo
+                pkg_config["build_flags"] = repo_flags
 
 
 def _fixup_build_flags(sync_config: SyncConfig) -> None:
@@ -92,5 +112,4 @@ def _fixup_build_flags(sync_config: SyncConfig) -> None:
             raise UserErrorMessage(
                 f"Forbidden repository name {repo}, this name has special meaning"
             )
-        repo_config = build_flags.setdefault(repo, copy.copy(default_flags))
-        repo_config.extend(global_flags)
+        build_flags[repo] = (*build_flags.get(repo, default_flags), *global_flags)
@@ -18,31 +18,32 @@ def run(cmd: list[str]):
 
 
 def run_out(cmd: list[str]) -> str:
+    # Binary pipes, the output is decoded once at the end (see run_inout)
     proc = subprocess.run(
         cmd,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        encoding="utf-8",
     )
     if proc.returncode != 0:
-        raise CommandException(cmd, proc.returncode, proc.stderr)
-    return proc.stdout
+        raise CommandException(cmd, proc.returncode, proc.stderr.decode("utf-8"))
+    return proc.stdout.decode("utf-8")
 
 
 def run_inout(cmd: list[str], input_data: str, *, cwd=None) -> tuple[str, str]:
     """Feed process input and return output"""
+    # Binary pipes: encode the input once up front and decode the output once at
+    # the end, instead of going through the text layer
     proc = subprocess.Popen(
         cmd,
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        encoding="utf-8",
         cwd=cwd,
     )
-    stdout, stderr = proc.communicate(input=input_data)
+    stdout, stderr = proc.communicate(input=input_data.encode("utf-8"))
     if proc.returncode != 0:
-        raise CommandException(cmd, proc.returncode, stderr)
-    return stdout, stderr
+        raise CommandException(cmd, proc.returncode, stderr.decode("utf-8"))
+    return stdout.decode("utf-8"), stderr.decode("utf-8")
 
 
 def run_in(cmd: list[str], input_data: str, *, cwd=None):